@@ -1,38 +1,150 @@
 # -*- coding: utf-8 -*-
 from flask import (
     Flask, render_template, redirect, url_for, request,
-    flash, make_response, jsonify
+    flash, jsonify, abort, send_file
 )
+from flask.json.provider import JSONProvider, _default as _flask_json_default
 from flask_sqlalchemy import SQLAlchemy
+from flask_caching import Cache
+from flask_compress import Compress
+from flask_wtf.csrf import CSRFProtect
 from flask_login import (
     LoginManager, UserMixin, login_user, logout_user,
     login_required, current_user
 )
 from datetime import datetime, date
-from io import BytesIO
+from functools import lru_cache
+from tempfile import NamedTemporaryFile, mkstemp
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet
+# ReportLab é importado só dentro das funções de PDF, para não pesar
+# na memória de cada worker que nunca gera um documento
 
+import orjson
+import glob
+import hashlib
 import sqlite3
 import os
 
+try:
+    import fcntl   # trava entre processos (indisponível no Windows)
+except ImportError:
+    fcntl = None
+import atexit
+import queue
+import threading
+import time
+
 # ✅ IMPORT NECESSÁRIO PARA SOMAS, AGRUPAMENTOS E FUNÇÕES SQL
-from sqlalchemy import func
+from sqlalchemy import func, case, event, insert, delete, text, or_, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.orm import contains_eager, selectinload, joinedload, deferred
+from werkzeug.security import generate_password_hash, check_password_hash
+import hmac
 
 
 # ============================
 # CONFIGURAÇÃO INICIAL DO APP
 # ============================
+class OrjsonProvider(JSONProvider):
+    """
+    JSON do app via orjson: serializa direto para bytes UTF-8.
+    Mantém a saída do DefaultJSONProvider do Flask: chaves ordenadas e o
+    mesmo `default` (datas em http_date, Decimal/UUID como texto etc.).
+    Dos kwargs do json.dumps só `default` e `sort_keys` são aceitos; os
+    demais (indent, separators...) são ignorados.
+    """
+
+    default = staticmethod(_flask_json_default)
+    sort_keys = True
+
+    def _orjson(self, obj, default=None, sort_keys=None):
+        opcoes = orjson.OPT_PASSTHROUGH_DATETIME   # datas vão para o default
+        if self.sort_keys if sort_keys is None else sort_keys:
+            opcoes |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=default or self.default, option=opcoes)
+
+    def dumps(self, obj, **kwargs):
+        return self._orjson(obj, kwargs.get('default'), kwargs.get('sort_keys')).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._orjson(obj), mimetype='application/json')
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config.from_object('config.Config')
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **app.config['SQLALCHEMY_ENGINE_OPTIONS'],
+        **app.config['SQLALCHEMY_POOL_OPTIONS'],
+    }
 
 db = SQLAlchemy(app)
+cache = Cache(app)
+Compress(app)
+# CSRF só nas rotas que chamam _exigir_csrf() (WTF_CSRF_CHECK_DEFAULT=False)
+csrf = CSRFProtect(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
 
+def _exigir_csrf():
+    """Confere o token CSRF do formulário (400 se faltar ou for inválido)."""
+    if app.config.get('WTF_CSRF_ENABLED', True):
+        csrf.protect()
+
+
+# ============================
+# PRAGMAS DO SQLITE
+# ============================
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL + synchronous=NORMAL: menos fsync por commit e leituras concorrentes."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    cur = dbapi_connection.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA mmap_size=268435456")
+    cur.execute("PRAGMA cache_size=-65536")
+    cur.close()
+
+
+# ============================
+# HORA UTC CALCULADA NO BANCO
+# ============================
+class agora_utc(FunctionElement):
+    """
+    Equivalente SQL do datetime.utcnow() usado nos defaults dos modelos.
+    O now() do PostgreSQL vem no fuso da sessão, por isso é convertido
+    para UTC; o CURRENT_TIMESTAMP do SQLite já é UTC.
+    """
+    type = db.DateTime()
+    inherit_cache = True
+
+
+@compiles(agora_utc)
+def _agora_utc_padrao(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(agora_utc, 'postgresql')
+def _agora_utc_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
 # ============================
 # MODELOS
 # ============================
@@ -41,9 +153,31 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(120))
     login = db.Column(db.String(80), unique=True)
-    senha = db.Column(db.String(120))
+    # legado: senha em texto puro, só lida no login para migrar ao hash
+    senha = deferred(db.Column(db.String(120)))
+    senha_hash = db.Column(db.String(255))
     role = db.Column(db.String(50), default='user')  # admin / supervisor / user
 
+    def definir_senha(self, senha):
+        self.senha_hash = generate_password_hash(senha)
+        self.senha = None
+
+    def verificar_senha(self, senha):
+        """
+        Confere a senha. Usuários ainda em texto puro são comparados em
+        tempo constante e migrados para hash no primeiro login certo.
+        """
+        if self.senha_hash:
+            return check_password_hash(self.senha_hash, senha)
+
+        if self.senha is not None and hmac.compare_digest(
+            self.senha.encode(), senha.encode()
+        ):
+            self.definir_senha(senha)
+            return True
+
+        return False
+
 
 # ============================
 # EPI
@@ -93,15 +227,38 @@ class Funcionario(db.Model):
     matricula = db.Column(db.String(50), unique=True, nullable=False)
     setor = db.Column(db.String(120))
     data_admissao = db.Column(db.Date)
-    senha_validacao = db.Column(db.String(120))
+    # hash da senha de validação ('' = sem senha); linhas antigas em texto puro
+    senha_validacao = db.Column(db.String(255))
 
+    # passive_deletes: as entregas são apagadas em bloco (ou pelo ON DELETE
+    # CASCADE), sem o ORM carregá-las uma a uma antes de excluir
     entregas = db.relationship(
         'EntregaEpi',
         backref='funcionario',
         lazy=True,
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
 
+    def definir_senha_validacao(self, senha):
+        self.senha_validacao = generate_password_hash(senha) if senha else ''
+
+    def verificar_senha_validacao(self, senha):
+        """
+        Confere a senha de validação da entrega. Senhas ainda em texto puro
+        são comparadas em tempo constante e migradas para hash na hora.
+        """
+        atual = self.senha_validacao or ''
+        if atual.startswith(('scrypt:', 'pbkdf2:')):
+            return check_password_hash(atual, senha)
+
+        if hmac.compare_digest(atual.encode(), senha.encode()):
+            if atual:
+                self.definir_senha_validacao(senha)
+            return True
+
+        return False
+
 
 # ============================
 # ENTREGA DE EPI
@@ -109,6 +266,14 @@ class Funcionario(db.Model):
 class EntregaEpi(db.Model):
     __tablename__ = 'entrega_epi'
 
+    # índices para os filtros mais usados (status + período, por
+    # colaborador e por EPI) no dashboard, entregas e ficha
+    __table_args__ = (
+        db.Index('ix_entrega_status_data', 'status', 'data_entrega'),
+        db.Index('ix_entrega_funcionario_status', 'funcionario_id', 'status'),
+        db.Index('ix_entrega_epi_status', 'epi_id', 'status'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     funcionario_id = db.Column(db.Integer, db.ForeignKey('funcionario.id', ondelete='CASCADE'), nullable=False)
     epi_id = db.Column(db.Integer, db.ForeignKey('epi.id', ondelete='CASCADE'), nullable=False)
@@ -151,13 +316,18 @@ class Log(db.Model):
     acao = db.Column(db.String(255))
     data_hora = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # tela de logs: mais recentes primeiro, filtrando por período
+    __table_args__ = (
+        db.Index('ix_log_data_hora', 'data_hora'),
+    )
+
 
 # ============================
 # LOGIN MANAGER
 # ============================
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return db.session.get(User, int(user_id))
 
 
 # ============================
@@ -205,20 +375,20 @@ def _ensure_table_columns():
         # -------------------------
         # TABELA EntregaEpi
         # -------------------------
-        cur.execute("PRAGMA table_info(EntregaEpi);")
+        cur.execute("PRAGMA table_info(entrega_epi);")
         entrega_cols = [r[1] for r in cur.fetchall()]
 
         if "status" not in entrega_cols:
-            cur.execute("ALTER TABLE EntregaEpi ADD COLUMN status TEXT DEFAULT 'entregue'")
+            cur.execute("ALTER TABLE entrega_epi ADD COLUMN status TEXT DEFAULT 'entregue'")
 
         if "observacao" not in entrega_cols:
-            cur.execute("ALTER TABLE EntregaEpi ADD COLUMN observacao TEXT")
+            cur.execute("ALTER TABLE entrega_epi ADD COLUMN observacao TEXT")
 
         if "data_devolucao" not in entrega_cols:
-            cur.execute("ALTER TABLE EntregaEpi ADD COLUMN data_devolucao TEXT")
+            cur.execute("ALTER TABLE entrega_epi ADD COLUMN data_devolucao TEXT")
 
         if "data_descarte" not in entrega_cols:
-            cur.execute("ALTER TABLE EntregaEpi ADD COLUMN data_descarte TEXT")
+            cur.execute("ALTER TABLE entrega_epi ADD COLUMN data_descarte TEXT")
 
         # -------------------------
         # TABELA epi
@@ -240,18 +410,326 @@ def _ensure_table_columns():
 
         con.commit()
         con.close()
+        return True
 
     except Exception as e:
         print(f"[WARN] Migração automática SQLite falhou: {e}")
+        return False
+
+
+# ============================
+# ÍNDICES EM BANCOS JÁ EXISTENTES
+# ============================
+def _ensure_indexes():
+    """
+    Cria os índices declarados nos modelos que ainda não existem.
+    O db.create_all() só cria índices junto com tabelas novas.
+    """
+    try:
+        for modelo in (EntregaEpi, Log):
+            for index in modelo.__table__.indexes:
+                index.create(bind=db.engine, checkfirst=True)
+        return True
+    except Exception as e:
+        print(f"[WARN] Criação de índices falhou: {e}")
+        return False
+
+
+# ============================
+# COLUNA DE HASH DA SENHA
+# ============================
+def _ensure_senha_hash_column():
+    """
+    Adiciona user.senha_hash em bancos criados antes do hash de senha.
+    Usa o inspector do SQLAlchemy, então vale para SQLite e PostgreSQL.
+    """
+    try:
+        colunas = [c["name"] for c in db.inspect(db.engine).get_columns("user")]
+        if "senha_hash" not in colunas:
+            with db.engine.begin() as conn:
+                conn.execute(text('ALTER TABLE "user" ADD COLUMN senha_hash VARCHAR(255)'))
+        return True
+    except Exception as e:
+        print(f"[WARN] Criação da coluna senha_hash falhou: {e}")
+        return False
+
+
+def _ensure_senha_validacao_tamanho():
+    """
+    Alarga funcionario.senha_validacao para caber o hash (VARCHAR(255)).
+    O SQLite não limita o tamanho do VARCHAR, então lá não há o que fazer.
+    """
+    if db.engine.dialect.name == "sqlite":
+        return True
+
+    try:
+        colunas = {c["name"]: c for c in db.inspect(db.engine).get_columns("funcionario")}
+        tamanho = getattr(colunas["senha_validacao"]["type"], "length", None)
+        if tamanho is not None and tamanho < 255:
+            with db.engine.begin() as conn:
+                conn.execute(text(
+                    "ALTER TABLE funcionario ALTER COLUMN senha_validacao TYPE VARCHAR(255)"
+                ))
+        return True
+    except Exception as e:
+        print(f"[WARN] Ajuste da coluna senha_validacao falhou: {e}")
+        return False
+
+
+# ============================
+# BUSCA FULL-TEXT DE EPIs (SQLITE)
+# ============================
+def _ensure_epi_fts():
+    """
+    Cria (no SQLite) o índice FTS5 epi_fts sobre nome, código e CA,
+    mantido em sincronia com a tabela epi por triggers.
+    Em outros bancos não faz nada: a busca cai no ilike.
+    """
+    if db.engine.dialect.name != "sqlite":
+        return True
+
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS epi_fts USING fts5("
+                "nome, codigo_produto, numero_ca, content='epi', content_rowid='id')"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS epi_fts_ai AFTER INSERT ON epi BEGIN "
+                "INSERT INTO epi_fts(rowid, nome, codigo_produto, numero_ca) "
+                "VALUES (new.id, new.nome, new.codigo_produto, new.numero_ca); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS epi_fts_ad AFTER DELETE ON epi BEGIN "
+                "INSERT INTO epi_fts(epi_fts, rowid, nome, codigo_produto, numero_ca) "
+                "VALUES ('delete', old.id, old.nome, old.codigo_produto, old.numero_ca); END"
+            ))
+            # só quando muda um campo indexado: as baixas/entradas de estoque
+            # (UPDATE epi SET quantidade = ...) não mexem no índice
+            conn.execute(text("DROP TRIGGER IF EXISTS epi_fts_au"))
+            conn.execute(text(
+                "CREATE TRIGGER epi_fts_au "
+                "AFTER UPDATE OF nome, codigo_produto, numero_ca ON epi BEGIN "
+                "INSERT INTO epi_fts(epi_fts, rowid, nome, codigo_produto, numero_ca) "
+                "VALUES ('delete', old.id, old.nome, old.codigo_produto, old.numero_ca); "
+                "INSERT INTO epi_fts(rowid, nome, codigo_produto, numero_ca) "
+                "VALUES (new.id, new.nome, new.codigo_produto, new.numero_ca); END"
+            ))
+            # indexa o que já estava cadastrado
+            conn.execute(text("INSERT INTO epi_fts(epi_fts) VALUES ('rebuild')"))
+        return True
+    except Exception as e:
+        print(f"[WARN] Criação do índice FTS de EPIs falhou: {e}")
+        return False
+
+
+def _buscar_epis(filtro):
+    """
+    EPIs cujo nome, código ou CA começam com as palavras de `filtro`.
+    Usa o FTS5 no SQLite e ilike nos demais bancos (ou se o FTS falhar).
+    """
+    if db.engine.dialect.name == "sqlite":
+        # cada palavra vira um termo entre aspas com busca por prefixo
+        termos = " ".join(
+            '"' + palavra.replace('"', '""') + '"*' for palavra in filtro.split()
+        )
+        try:
+            ids = db.session.execute(
+                text("SELECT rowid FROM epi_fts WHERE epi_fts MATCH :q"),
+                {"q": termos}
+            ).scalars().all()
+            return Epi.query.filter(Epi.id.in_(ids)).all() if ids else []
+        except Exception as e:
+            db.session.rollback()
+            print(f"[WARN] Busca FTS indisponível, usando ilike: {e}")
+
+    termo = f"%{filtro}%"
+    return Epi.query.filter(
+        or_(
+            Epi.nome.ilike(termo),
+            Epi.codigo_produto.ilike(termo),
+            Epi.numero_ca.ilike(termo)
+        )
+    ).all()
+
+
+# ============================
+# BUSCA DE LOGS (POSTGRESQL)
+# ============================
+# Usuário e ação numa expressão só: o filtro da tela de logs e o índice
+# trigram usam exatamente o mesmo texto, para o PostgreSQL casar os dois.
+LOG_BUSCA_SQL = "(coalesce(usuario, '') || ' ' || coalesce(acao, ''))"
+
+
+def _ensure_log_trgm():
+    """
+    Cria (no PostgreSQL) o índice GIN trigram sobre LOG_BUSCA_SQL, que
+    atende o ilike com curinga no início. Em outros bancos não faz nada.
+    """
+    if db.engine.dialect.name != "postgresql":
+        return True
+
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_log_busca_trgm ON log "
+                f"USING gin ({LOG_BUSCA_SQL} gin_trgm_ops)"
+            ))
+        return True
+    except Exception as e:
+        print(f"[WARN] Criação do índice trigram de logs falhou: {e}")
+        return False
+
+
+# ============================
+# MIGRAÇÃO NA SUBIDA (UMA VEZ SÓ)
+# ============================
+# Aumente ao mudar qualquer função _ensure_* chamada abaixo para que os
+# bancos já marcados passem pela verificação de novo.
+ESQUEMA_VERSAO = 7
+
+
+def _versao_esquema(conn):
+    """Versão gravada no próprio banco (tabela de uma linha esquema_versao)."""
+    conn.execute(text("CREATE TABLE IF NOT EXISTS esquema_versao (versao INTEGER NOT NULL)"))
+    return conn.execute(text("SELECT versao FROM esquema_versao")).scalar()
+
+
+def _migrar_banco():
+    """
+    Roda o create_all sempre (barato e cobre banco recriado/apagado) e
+    colunas + índices apenas se o banco ainda não foi marcado com a
+    ESQUEMA_VERSAO atual. A marca fica no próprio banco e um flock em
+    instance/ garante que só um processo (worker) migra por vez; os demais
+    encontram a marca e pulam os PRAGMAs/ALTERs.
+    """
+    os.makedirs(app.instance_path, exist_ok=True)
+
+    with open(os.path.join(app.instance_path, ".migracao.lock"), "w") as trava:
+        if fcntl:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+
+        try:
+            db.create_all()
+
+            with db.engine.begin() as conn:
+                if _versao_esquema(conn) == ESQUEMA_VERSAO:
+                    return
+
+            ok = _ensure_table_columns() is not False
+            ok = _ensure_indexes() and ok
+            ok = _ensure_epi_fts() and ok
+            ok = _ensure_log_trgm() and ok
+            ok = _ensure_senha_hash_column() and ok
+            ok = _ensure_senha_validacao_tamanho() and ok
+
+            if ok:
+                with db.engine.begin() as conn:
+                    conn.execute(text("DELETE FROM esquema_versao"))
+                    conn.execute(text("INSERT INTO esquema_versao (versao) VALUES (:v)"),
+                                 {"v": ESQUEMA_VERSAO})
+        finally:
+            if fcntl:
+                fcntl.flock(trava, fcntl.LOCK_UN)
 
 
 # ============================
 # FUNÇÃO PARA REGISTRAR LOGS
 # ============================
+# Os logs vão para uma fila e uma thread de fundo grava em lote
+# (até LOG_LOTE_MAX linhas ou a cada LOG_INTERVALO segundos), tirando
+# o INSERT + commit do log do caminho de cada requisição.
+# Só entram na fila depois do commit da requisição: se ela fizer rollback,
+# o log da ação que não aconteceu é descartado.
+LOG_LOTE_MAX = 100
+LOG_INTERVALO = 0.5
+
+_fila_logs = queue.Queue()
+_thread_logs = None
+_thread_logs_lock = threading.Lock()
+
+
+def _gravar_logs(linhas):
+    try:
+        with app.app_context():
+            db.session.execute(insert(Log), linhas)
+            db.session.commit()
+    except Exception as e:
+        print(f"[WARN] Falha ao gravar {len(linhas)} log(s): {e}")
+
+
+def _worker_logs():
+    while True:
+        item = _fila_logs.get()
+        if item is None:
+            _fila_logs.task_done()
+            return
+
+        linhas = [item]
+        prazo = time.monotonic() + LOG_INTERVALO
+        fim = False
+
+        while len(linhas) < LOG_LOTE_MAX:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                item = _fila_logs.get(timeout=restante)
+            except queue.Empty:
+                break
+            if item is None:
+                fim = True
+                break
+            linhas.append(item)
+
+        _gravar_logs(linhas)
+        for _ in range(len(linhas) + fim):
+            _fila_logs.task_done()
+
+        if fim:
+            return
+
+
+def _iniciar_thread_logs():
+    """Sobe a thread na primeira chamada (depois do fork dos workers)."""
+    global _thread_logs
+
+    with _thread_logs_lock:
+        if _thread_logs is None or not _thread_logs.is_alive():
+            _thread_logs = threading.Thread(
+                target=_worker_logs, name="gravador-logs", daemon=True
+            )
+            _thread_logs.start()
+
+
+@atexit.register
+def _encerrar_thread_logs():
+    """Grava o que ainda estiver na fila antes de o processo sair."""
+    if _thread_logs is not None and _thread_logs.is_alive():
+        _fila_logs.put(None)
+        _thread_logs.join(timeout=5)
+
+
 def registrar_log(usuario, acao):
-    novo_log = Log(usuario=usuario, acao=acao, data_hora=datetime.now())
-    db.session.add(novo_log)
-    db.session.commit()
+    """Guarda o log na sessão; ele vai para a fila no próximo commit."""
+    db.session.info.setdefault("logs_pendentes", []).append(
+        {"usuario": usuario, "acao": acao, "data_hora": datetime.now()}
+    )
+
+
+@event.listens_for(db.session, "after_commit")
+def _enfileirar_logs(session):
+    linhas = session.info.pop("logs_pendentes", None)
+    if linhas:
+        _iniciar_thread_logs()
+        for linha in linhas:
+            _fila_logs.put(linha)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _descartar_logs(session):
+    session.info.pop("logs_pendentes", None)
 
 
 # ============================
@@ -274,11 +752,13 @@ def login():
     if request.method == 'POST':
         login_usuario = (request.form.get('login') or '').strip()
         senha = request.form.get('senha') or ''
-        user = User.query.filter_by(login=login_usuario, senha=senha).first()
+        # busca só pelo login (índice único); a senha é conferida pelo hash
+        user = User.query.filter_by(login=login_usuario).first()
 
-        if user:
-            login_user(user)
+        if user and user.verificar_senha(senha):
             registrar_log(user.nome, "Realizou login no sistema")
+            db.session.commit()   # grava o hash se a senha foi migrada agora
+            login_user(user)
             return redirect(url_for('dashboard'))
         else:
             erro_login = "⚠️ Login ou senha incorretos!"
@@ -290,6 +770,7 @@ def login():
 @login_required
 def logout():
     registrar_log(current_user.nome, "Saiu do sistema")
+    db.session.commit()   # libera o log (não há alteração a gravar)
     logout_user()
     return redirect(url_for('login'))
 
@@ -301,30 +782,59 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
+    data_inicio_str = request.args.get('data_inicio', '').strip()
+    data_fim_str = request.args.get('data_fim', '').strip()
+
+    return render_template(
+        "dashboard.html",
+        user=current_user,
+        **_metricas_dashboard(data_inicio_str, data_fim_str)
+    )
+
+
+def _invalidar_dashboard():
+    """Descarta os números em cache após qualquer alteração nos dados."""
+    cache.delete_memoized(_metricas_dashboard)
+
+
+def _parse_data(s):
+    """
+    Converte 'YYYY-MM-DD' ou 'DD/MM/YYYY' em datetime fatiando a string,
+    sem o custo do strptime. Retorna None se não for uma data válida.
+    """
+    if not s or len(s) != 10:
+        return None
+    try:
+        if s[4] == '-' and s[7] == '-':
+            return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+        if s[2] == '/' and s[5] == '/':
+            return datetime(int(s[6:10]), int(s[3:5]), int(s[0:2]))
+    except ValueError:
+        pass
+    return None
+
+
+def _colunas(rows, n):
+    """Transpõe linhas em n listas: [(a, 1), (b, 2)] -> [a, b], [1, 2]."""
+    if not rows:
+        return tuple([] for _ in range(n))
+    return tuple(list(coluna) for coluna in zip(*rows))
+
+
+@cache.memoize(timeout=30)
+def _metricas_dashboard(data_inicio_str, data_fim_str):
+    """Números e séries do dashboard, em cache por 30s para cada período."""
 
     # ============================
     # FILTRO DE PERÍODO
     # ============================
-    data_inicio_str = request.args.get('data_inicio', '').strip()
-    data_fim_str = request.args.get('data_fim', '').strip()
-
     filtro_ativo = False
     dt_inicio = None
     dt_fim = None
 
-    def parse_data(s):
-        if not s:
-            return None
-        for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
-            try:
-                return datetime.strptime(s, fmt)
-            except:
-                pass
-        return None
-
     if data_inicio_str and data_fim_str:
-        dt_inicio = parse_data(data_inicio_str)
-        dt_fim = parse_data(data_fim_str)
+        dt_inicio = _parse_data(data_inicio_str)
+        dt_fim = _parse_data(data_fim_str)
 
         if dt_inicio and dt_fim:
             dt_fim = dt_fim.replace(hour=23, minute=59, second=59)
@@ -333,67 +843,81 @@ def dashboard():
     # ============================
     # MÉTRICAS FIXAS
     # ============================
-    total_epis = Epi.query.count()
-    total_funcionarios = Funcionario.query.count()
-    total_usuarios = User.query.count()
+    # Os contadores viram subconsultas escalares e são lidos todos
+    # juntos em um único SELECT (ver RESUMO abaixo)
+    total_epis_sq = db.session.query(func.count(Epi.id)).scalar_subquery()
+    total_funcionarios_sq = db.session.query(func.count(Funcionario.id)).scalar_subquery()
+    total_usuarios_sq = db.session.query(func.count(User.id)).scalar_subquery()
 
     # ============================
     # ESTOQUE CRÍTICO (agora filtrado)
     # ============================
-    epi_query = Epi.query
-
     if filtro_ativo:
-        epis_criticos = (
-            db.session.query(Epi)
+        criticos_rows = (
+            db.session.query(Epi.id, Epi.nome, Epi.quantidade)
             .join(EntregaEpi, EntregaEpi.epi_id == Epi.id)
             .filter(
                 EntregaEpi.data_entrega >= dt_inicio,
                 EntregaEpi.data_entrega <= dt_fim,
                 Epi.quantidade <= 10
             )
+            .distinct()
             .all()
         )
     else:
-        epis_criticos = Epi.query.filter(Epi.quantidade <= 10).all()
+        criticos_rows = (
+            db.session.query(Epi.id, Epi.nome, Epi.quantidade)
+            .filter(Epi.quantidade <= 10)
+            .all()
+        )
 
-    total_criticos = len(epis_criticos)
-    nomes_criticos = [e.nome for e in epis_criticos]
-    qtd_criticos = [e.quantidade for e in epis_criticos]
+    # só as colunas usadas no gráfico, sem montar objetos Epi
+    total_criticos = len(criticos_rows)
+    _, nomes_criticos, qtd_criticos = _colunas(criticos_rows, 3)
 
     # ============================
     # CA VENCIDO (não precisa filtro)
     # ============================
     hoje = date.today()
-    vencidos = []
-
-    def parse_ca(valor):
-        for fmt in ("%d/%m/%Y", "%Y-%m-%d"):
-            try:
-                return datetime.strptime(valor, fmt).date()
-            except:
-                pass
-        return None
 
-    for e in Epi.query.all():
-        validade = parse_ca(e.validade_ca)
-        if validade and validade < hoje:
-            vencidos.append(e)
+    # validade_ca é texto (DD/MM/YYYY ou YYYY-MM-DD): normaliza para
+    # YYYY-MM-DD no próprio SQL e compara como string, contando no banco
+    validade_iso = case(
+        (
+            Epi.validade_ca.like('__/__/____'),
+            func.substr(Epi.validade_ca, 7, 4, type_=db.String) + '-' +
+            func.substr(Epi.validade_ca, 4, 2, type_=db.String) + '-' +
+            func.substr(Epi.validade_ca, 1, 2, type_=db.String)
+        ),
+        (Epi.validade_ca.like('____-__-__'), Epi.validade_ca),
+    )
 
-    total_vencidos = len(vencidos)
+    total_vencidos_sq = (
+        db.session.query(func.count(Epi.id))
+        .filter(validade_iso < hoje.isoformat())
+        .scalar_subquery()
+    )
 
     # ============================
     # ENTREGAS NO MÊS
     # ============================
     inicio_mes = datetime(hoje.year, hoje.month, 1)
-    entregas_mes = EntregaEpi.query.filter(
-        EntregaEpi.data_entrega >= inicio_mes,
-        EntregaEpi.status == 'entregue'
-    ).count()
+    entregas_mes_sq = (
+        db.session.query(func.count(EntregaEpi.id))
+        .filter(
+            EntregaEpi.data_entrega >= inicio_mes,
+            EntregaEpi.status == 'entregue'
+        )
+        .scalar_subquery()
+    )
 
     # ============================
     # BASE FILTRADA
     # ============================
-    base_entregas = EntregaEpi.query.filter(EntregaEpi.status == 'entregue')
+    base_entregas = (
+        db.session.query(func.count(EntregaEpi.id))
+        .filter(EntregaEpi.status == 'entregue')
+    )
 
     if filtro_ativo:
         base_entregas = base_entregas.filter(
@@ -401,32 +925,67 @@ def dashboard():
             EntregaEpi.data_entrega <= dt_fim
         )
 
-    total_entregas = base_entregas.count()
-    pendencias = base_entregas.filter(EntregaEpi.quantidade > 0).count()
+    total_entregas_sq = base_entregas.scalar_subquery()
+    pendencias_sq = (
+        base_entregas.filter(EntregaEpi.quantidade > 0).scalar_subquery()
+    )
 
     # ============================
     # CUSTO DO PERÍODO
     # ============================
-    custo_rows = (
-        db.session.query(Epi.valor_unitario, EntregaEpi.quantidade)
+    custo_query = (
+        db.session.query(
+            func.coalesce(
+                func.sum(
+                    func.coalesce(Epi.valor_unitario, 0) *
+                    func.coalesce(EntregaEpi.quantidade, 0)
+                ),
+                0
+            )
+        )
         .join(EntregaEpi, EntregaEpi.epi_id == Epi.id)
         .filter(EntregaEpi.status == "entregue")
     )
 
     if filtro_ativo:
-        custo_rows = custo_rows.filter(
+        custo_query = custo_query.filter(
             EntregaEpi.data_entrega >= dt_inicio,
             EntregaEpi.data_entrega <= dt_fim
         )
 
-    custo_mes = sum((r[0] or 0) * (r[1] or 0) for r in custo_rows.all())
+    custo_sq = custo_query.scalar_subquery()
+
+    # ============================
+    # RESUMO — UMA ÚNICA IDA AO BANCO
+    # ============================
+    (
+        total_epis,
+        total_funcionarios,
+        total_usuarios,
+        total_vencidos,
+        entregas_mes,
+        total_entregas,
+        pendencias,
+        custo_mes,
+    ) = db.session.query(
+        total_epis_sq,
+        total_funcionarios_sq,
+        total_usuarios_sq,
+        total_vencidos_sq,
+        entregas_mes_sq,
+        total_entregas_sq,
+        pendencias_sq,
+        custo_sq,
+    ).one()
+
+    custo_mes = float(custo_mes or 0)
 
     # ============================
     # EPIs por Tipo (AGORA FILTRADOOO)
     # ============================
     if filtro_ativo:
         tipo_rows = (
-            db.session.query(Epi.nome, func.sum(EntregaEpi.quantidade))
+            db.session.query(Epi.nome, func.coalesce(func.sum(EntregaEpi.quantidade), 0))
             .join(EntregaEpi, EntregaEpi.epi_id == Epi.id)
             .filter(
                 EntregaEpi.data_entrega >= dt_inicio,
@@ -436,12 +995,11 @@ def dashboard():
             .group_by(Epi.nome)
             .all()
         )
-        tipos_epi = [row[0] for row in tipo_rows]
-        qtd_epi = [int(row[1] or 0) for row in tipo_rows]
     else:
-        epis = Epi.query.all()
-        tipos_epi = [e.nome for e in epis]
-        qtd_epi = [e.quantidade for e in epis]
+        # só nome/quantidade, sem montar objetos Epi
+        tipo_rows = db.session.query(Epi.nome, func.coalesce(Epi.quantidade, 0)).all()
+
+    tipos_epi, qtd_epi = _colunas(tipo_rows, 2)
 
     # ============================
     # Entregas por Colaborador (já filtrado)
@@ -459,14 +1017,13 @@ def dashboard():
         )
 
     colab_rows = colab_query.group_by(Funcionario.nome).all()
-    nomes_colabs = [row[0] for row in colab_rows]
-    qtd_entregas = [int(row[1]) for row in colab_rows]
+    nomes_colabs, qtd_entregas = _colunas(colab_rows, 2)
 
     # ============================
     # TOP 5 (já filtrado)
     # ============================
     usados_query = (
-        db.session.query(Epi.nome, func.sum(EntregaEpi.quantidade))
+        db.session.query(Epi.nome, func.coalesce(func.sum(EntregaEpi.quantidade), 0))
         .join(EntregaEpi, EntregaEpi.epi_id == Epi.id)
         .filter(EntregaEpi.status == 'entregue')
     )
@@ -481,16 +1038,12 @@ def dashboard():
                               .order_by(func.sum(EntregaEpi.quantidade).desc())\
                               .limit(5).all()
 
-    nomes_epi_mais_usados = [row[0] for row in usados_rows]
-    qtd_epi_mais_usados = [int(row[1] or 0) for row in usados_rows]
+    nomes_epi_mais_usados, qtd_epi_mais_usados = _colunas(usados_rows, 2)
 
     # ============================
-    # RENDER
+    # RESULTADO
     # ============================
-    return render_template(
-        "dashboard.html",
-        user=current_user,
-
+    return dict(
         total_epis=total_epis,
         total_entregas=total_entregas,
         total_funcionarios=total_funcionarios,
@@ -520,6 +1073,7 @@ def dashboard():
 # FUNÇÃO PARA REGISTRAR HISTÓRICO
 # =====================================================
 def registrar_historico(epi_id, acao, quantidade, usuario):
+    """Adiciona o histórico na sessão; o commit fica a cargo da rota."""
     registro = HistoricoEpi(
         epi_id=epi_id,
         acao=acao,
@@ -527,7 +1081,6 @@ def registrar_historico(epi_id, acao, quantidade, usuario):
         usuario=usuario
     )
     db.session.add(registro)
-    db.session.commit()
 
 
 # ============================
@@ -575,7 +1128,7 @@ def epis():
         )
 
         db.session.add(novo_epi)
-        db.session.commit()
+        db.session.flush()   # gera o id sem commit
 
         # 🔥 registra histórico inicial
         registrar_historico(
@@ -586,6 +1139,8 @@ def epis():
         )
 
         registrar_log(current_user.nome, f"Cadastrou novo EPI: {nome}")
+        db.session.commit()
+        _invalidar_dashboard()
         flash('✅ EPI cadastrado com sucesso!')
         return redirect(url_for('epis'))
 
@@ -594,11 +1149,7 @@ def epis():
     # ============================
     filtro = request.args.get('filtro', '').strip()
 
-    epis_list = (
-        Epi.query.filter(Epi.nome.ilike(f"%{filtro}%")).all()
-        if filtro else
-        Epi.query.all()
-    )
+    epis_list = _buscar_epis(filtro) if filtro else Epi.query.all()
 
     funcionarios = Funcionario.query.order_by(Funcionario.nome).all()
 
@@ -647,8 +1198,6 @@ def editar_epi(id):
             flash("⚠ Valor unitário inválido. Use apenas números e vírgula/ponto.")
             return redirect(url_for('epis'))
 
-    db.session.commit()
-
     # 🔥 Registra histórico apenas se a quantidade mudou
     if epi.quantidade != quantidade_antiga:
         ajuste = epi.quantidade - quantidade_antiga
@@ -660,6 +1209,8 @@ def editar_epi(id):
         )
 
     registrar_log(current_user.nome, f"Editou EPI: {epi.nome}")
+    db.session.commit()
+    _invalidar_dashboard()
     flash('✅ EPI atualizado com sucesso!')
     
     return redirect(url_for('epis'))
@@ -686,6 +1237,7 @@ def deletar_epi(id):
 
     db.session.delete(epi)
     db.session.commit()
+    _invalidar_dashboard()
 
     flash('🗑️ EPI removido com sucesso!')
     return redirect(url_for('epis'))
@@ -715,7 +1267,7 @@ def entregar_epi():
             flash('⚠️ Funcionário ou EPI inválido!')
             return redirect(url_for('epis'))
 
-        if (funcionario.senha_validacao or '') != senha:
+        if not funcionario.verificar_senha_validacao(senha):
             flash('🚫 Senha de validação incorreta!')
             return redirect(url_for('epis'))
 
@@ -743,7 +1295,6 @@ def entregar_epi():
         epi.quantidade = max(epi.quantidade - quantidade, 0)
 
         db.session.add(nova_entrega)
-        db.session.commit()
 
         # 🔥 histórico da entrega
         registrar_historico(
@@ -758,6 +1309,9 @@ def entregar_epi():
             f"Entregou {quantidade}x {epi.nome} a {funcionario.nome}"
         )
 
+        db.session.commit()
+        _invalidar_dashboard()
+
         flash(f'✅ {quantidade}x {epi.nome} entregue a {funcionario.nome}.')
         return redirect(url_for('epis'))
 
@@ -768,53 +1322,152 @@ def entregar_epi():
 
 
 # ============================
-# FICHA DE EPI (PDF)
+# RECURSOS FIXOS DOS PDFs
 # ============================
-@app.route('/ficha_epi/<int:funcionario_id>')
-@login_required
-def ficha_epi(funcionario_id):
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib import colors
-    from reportlab.platypus import Table, TableStyle, Paragraph
-    from reportlab.pdfgen import canvas
+TERMO_FICHA = (
+    "Declaro para os devidos fins que recebi os EPI's (Equipamentos de Proteção Individual) abaixo descritos "
+    "e me comprometo a:<br/><br/>"
+    "• Usá-los apenas para as finalidades a que se destinam;<br/>"
+    "• Responsabilizar-me por sua guarda e conservação;<br/>"
+    "• Comunicar ao empregador qualquer modificação que os torne impróprios para o uso;<br/>"
+    "• Responsabilizar-me pela danificação do E.P.I. devido ao uso inadequado ou fora das atividades a que se destinam, "
+    "bem como pelo seu extravio.<br/><br/>"
+    "Declaro ainda estar ciente de que o uso é obrigatório, sob pena de ser punido conforme LEI nº 6.514, "
+    "de 22/12/1977, artigo 158:<br/>"
+    "“Recusa injustificada ao uso do EPI constitui ato faltoso, autorizando a dispensa por justa causa.”<br/><br/>"
+    "Declaro também que recebi treinamento referente ao uso e conservação do E.P.I. segundo as Normas "
+    "de Segurança do Trabalho."
+)
+
+
+# O logo é desenhado em 60x40 pt; 4 px por ponto (~288 dpi) é o bastante
+LOGO_PDF_PIXELS = (240, 160)
+
+
+@lru_cache(maxsize=None)
+def _logo_pdf():
+    """
+    Logo dos PDFs, lido do disco e reduzido uma única vez por processo.
+    O PNG original (2423x671) era recomprimido inteiro em cada PDF, o que
+    dominava o tempo de geração e deixava cada arquivo com ~700 KB.
+    """
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+
+    logo_path = os.path.join(app.static_folder, "adaptlink.png")
+    if not os.path.exists(logo_path):
+        return None
+
+    with Image.open(logo_path) as img:
+        reduzida = img.convert("RGBA").resize(LOGO_PDF_PIXELS, Image.LANCZOS)
+
+    return ImageReader(reduzida)
+
+
+@lru_cache(maxsize=None)
+def _estilo_termo():
     from reportlab.lib.styles import ParagraphStyle
-    from datetime import datetime
-    from io import BytesIO
-    import os
 
-    # -----------------------------
-    # BUSCA DO COLABORADOR
-    # -----------------------------
-    func = Funcionario.query.get_or_404(funcionario_id)
+    return ParagraphStyle(
+        name="termo",
+        fontName="Helvetica",
+        fontSize=8.5,
+        leading=11,
+        alignment=0
+    )
 
-    # -----------------------------
-    # FILTRO DE PERÍODO
-    # -----------------------------
-    data_inicio = request.args.get("data_inicio")
-    data_fim = request.args.get("data_fim")
 
-    query = EntregaEpi.query.filter_by(funcionario_id=funcionario_id)
+# Termo do PDF de movimentação, já separado em linhas prontas para textLine
+TERMO_MOVIMENTACAO_LINHAS = tuple(linha.strip() for linha in (
+    "Declaro para os devidos fins que recebi o(s) EPI(s) relacionado(s) neste documento e me comprometo a:\n"
+    "• Usá-los apenas para as finalidades a que se destinam;\n"
+    "• Responsabilizar-me por sua guarda e conservação;\n"
+    "• Comunicar ao empregador qualquer modificação que os torne impróprios para o uso;\n"
+    "• Responsabilizar-me pela danificação do E.P.I. devido ao uso inadequado ou fora das atividades a que se destinam, bem como pelo seu extravio.\n\n"
+    "Declaro ainda estar ciente de que o uso é obrigatório, sob pena de ser punido conforme LEI nº 6.514/1977, artigo 158:\n"
+    "“Recusa injustificada ao uso do EPI constitui ato faltoso, autorizando a dispensa por justa causa.”\n\n"
+    "Declaro também que recebi treinamento referente ao uso e conservação do E.P.I. segundo as Normas de Segurança do Trabalho."
+).split("\n"))
 
-    if data_inicio and data_fim:
-        try:
-            dt_inicio = datetime.strptime(data_inicio, "%Y-%m-%d")
-            dt_fim = datetime.strptime(data_fim, "%Y-%m-%d")
-            dt_fim = dt_fim.replace(hour=23, minute=59, second=59)
 
-            query = query.filter(
-                EntregaEpi.data_entrega >= dt_inicio,
-                EntregaEpi.data_entrega <= dt_fim
-            )
-        except Exception as e:
-            print("Erro no filtro:", e)
+@lru_cache(maxsize=None)
+def _estilo_tabela_movimentacao():
+    from reportlab.lib import colors
+    from reportlab.platypus import TableStyle
 
-    entregas = query.order_by(EntregaEpi.data_entrega.asc()).all()
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        ('GRID', (0, 0), (-1, -1), 0.3, colors.grey),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ])
 
-    # -----------------------------
-    # INÍCIO DO PDF
-    # -----------------------------
-    buffer = BytesIO()
-    pdf = canvas.Canvas(buffer, pagesize=A4)
+
+@lru_cache(maxsize=None)
+def _termo_ficha(largura):
+    """
+    Parágrafo do termo já interpretado e quebrado em linhas para `largura`.
+    O texto é fixo, então o parse da marcação é feito uma vez só.
+    """
+    from reportlab.platypus import Paragraph
+
+    p = Paragraph(TERMO_FICHA, _estilo_termo())
+    _, altura = p.wrap(largura, 500)
+    return p, altura
+
+
+# ============================
+# FICHA DE EPI (PDF)
+# ============================
+@lru_cache(maxsize=None)
+def _pdf_pool():
+    """
+    Processos dedicados à renderização dos PDFs (ReportLab é CPU-bound).
+    Cada processo já sobe com o logo decodificado (_logo_pdf em cache),
+    então nem o primeiro PDF de cada um paga a leitura do PNG.
+    """
+    return ProcessPoolExecutor(max_workers=app.config.get('PDF_WORKERS', 2),
+                               initializer=_logo_pdf)
+
+
+_pdf_pool_lock = threading.Lock()
+
+
+def _rodar_pdf(funcao, *args):
+    """
+    Executa `funcao` no _pdf_pool() e devolve o resultado. Se um processo
+    do pool morreu (OOM, segfault) o pool inteiro fica quebrado: descarta,
+    sobe um novo e tenta mais uma vez.
+    """
+    pool = _pdf_pool()
+    try:
+        return pool.submit(funcao, *args).result()
+    except BrokenProcessPool:
+        # outra thread pode já ter trocado o pool quebrado
+        with _pdf_pool_lock:
+            if _pdf_pool() is pool:
+                pool.shutdown(wait=False)
+                _pdf_pool.cache_clear()
+        return _pdf_pool().submit(funcao, *args).result()
+
+
+def _gerar_ficha_pdf(funcionario, periodo, linhas):
+    """
+    Desenha a ficha num arquivo temporário e devolve o caminho.
+    Roda num processo do _pdf_pool(), por isso recebe só dados simples
+    (dicts/listas) e não objetos do banco.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.platypus import Table, TableStyle
+    from reportlab.pdfgen import canvas
+
+    arquivo = NamedTemporaryFile(suffix='.pdf', delete=False)
+    pdf = canvas.Canvas(arquivo, pagesize=A4)
     width, height = A4
 
     # ===== MOLDURA =====
@@ -823,9 +1476,9 @@ def ficha_epi(funcionario_id):
     pdf.rect(20, 20, width - 40, height - 40)
 
     # ===== LOGO (abaixada) =====
-    logo_path = os.path.join("static", "adaptlink.png")
-    if os.path.exists(logo_path):
-        pdf.drawImage(logo_path, 30, height - 70, width=60, height=40, mask='auto')
+    logo = _logo_pdf()
+    if logo:
+        pdf.drawImage(logo, 30, height - 70, width=60, height=40, mask='auto')
 
     # ===== CABEÇALHO (ajustado) =====
     pdf.setFont("Helvetica-Bold", 12)
@@ -851,12 +1504,12 @@ def ficha_epi(funcionario_id):
     pdf.line(40, height - 167, width - 40, height - 167)
 
     pdf.setFont("Helvetica", 9)
-    pdf.drawString(40, height - 180, f"Nome: {func.nome}")
+    pdf.drawString(40, height - 180, f"Nome: {funcionario['nome']}")
     pdf.drawRightString(width - 40, height - 180,
         f"Data de emissão: {datetime.now().strftime('%d/%m/%Y')}")
 
-    pdf.drawString(40, height - 192, f"Matrícula: {func.matricula}")
-    pdf.drawString(40, height - 204, f"Setor: {func.setor or '-'}")
+    pdf.drawString(40, height - 192, f"Matrícula: {funcionario['matricula']}")
+    pdf.drawString(40, height - 204, f"Setor: {funcionario['setor'] or '-'}")
 
     # ===== PERÍODO =====
     pdf.setFont("Helvetica-Bold", 10)
@@ -864,38 +1517,10 @@ def ficha_epi(funcionario_id):
     pdf.line(40, height - 222, width - 40, height - 222)
 
     pdf.setFont("Helvetica", 9)
-    if data_inicio and data_fim:
-        pdf.drawString(40, height - 235,
-            f"Movimentações entre: {dt_inicio.strftime('%d/%m/%Y')} até {dt_fim.strftime('%d/%m/%Y')}")
-    else:
-        pdf.drawString(40, height - 235, "Movimentações de todo o período")
+    pdf.drawString(40, height - 235, periodo)
 
     # ===== TERMO =====
-    termo_texto = (
-        "Declaro para os devidos fins que recebi os EPI's (Equipamentos de Proteção Individual) abaixo descritos "
-        "e me comprometo a:<br/><br/>"
-        "• Usá-los apenas para as finalidades a que se destinam;<br/>"
-        "• Responsabilizar-me por sua guarda e conservação;<br/>"
-        "• Comunicar ao empregador qualquer modificação que os torne impróprios para o uso;<br/>"
-        "• Responsabilizar-me pela danificação do E.P.I. devido ao uso inadequado ou fora das atividades a que se destinam, "
-        "bem como pelo seu extravio.<br/><br/>"
-        "Declaro ainda estar ciente de que o uso é obrigatório, sob pena de ser punido conforme LEI nº 6.514, "
-        "de 22/12/1977, artigo 158:<br/>"
-        "“Recusa injustificada ao uso do EPI constitui ato faltoso, autorizando a dispensa por justa causa.”<br/><br/>"
-        "Declaro também que recebi treinamento referente ao uso e conservação do E.P.I. segundo as Normas "
-        "de Segurança do Trabalho."
-    )
-
-    estilo_termo = ParagraphStyle(
-        name="termo",
-        fontName="Helvetica",
-        fontSize=8.5,
-        leading=11,
-        alignment=0
-    )
-
-    p = Paragraph(termo_texto, estilo_termo)
-    termo_width, termo_height = p.wrap(width - 80, 500)
+    p, termo_height = _termo_ficha(width - 80)
 
     termo_y = height - 270
     p.drawOn(pdf, 40, termo_y - termo_height)
@@ -904,25 +1529,7 @@ def ficha_epi(funcionario_id):
 
     # ===== TABELA =====
     data = [["Descrição do EPI", "CA", "Qtde", "Entrega", "Devolução/Descarte", "Status"]]
-
-    for e in entregas:
-        data_entrega = e.data_entrega.strftime('%d/%m/%Y')
-
-        if e.data_devolucao:
-            data_dev = e.data_devolucao.strftime('%d/%m/%Y')
-        elif e.data_descarte:
-            data_dev = e.data_descarte.strftime('%d/%m/%Y')
-        else:
-            data_dev = "-"
-
-        data.append([
-            e.epi.nome,
-            e.epi.numero_ca or "-",
-            str(e.quantidade),
-            data_entrega,
-            data_dev,
-            e.status.capitalize()
-        ])
+    data.extend(linhas)
 
     table = Table(data, colWidths=[150, 50, 40, 80, 90, 60])
     table.setStyle(TableStyle([
@@ -956,16 +1563,80 @@ def ficha_epi(funcionario_id):
 
     pdf.showPage()
     pdf.save()
+    arquivo.close()
 
-    pdf_data = buffer.getvalue()
-    buffer.close()
+    return arquivo.name
 
-    response = make_response(pdf_data)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = (
-        f'inline; filename=ficha_{func.nome.replace(" ", "_")}.pdf'
-    )
 
+@app.route('/ficha_epi/<int:funcionario_id>')
+@login_required
+def ficha_epi(funcionario_id):
+    # -----------------------------
+    # BUSCA DO COLABORADOR
+    # -----------------------------
+    func = Funcionario.query.get_or_404(funcionario_id)
+
+    # -----------------------------
+    # FILTRO DE PERÍODO
+    # -----------------------------
+    data_inicio = request.args.get("data_inicio")
+    data_fim = request.args.get("data_fim")
+
+    query = EntregaEpi.query.filter_by(funcionario_id=funcionario_id)
+
+    if data_inicio and data_fim:
+        try:
+            dt_inicio = datetime.strptime(data_inicio, "%Y-%m-%d")
+            dt_fim = datetime.strptime(data_fim, "%Y-%m-%d")
+            dt_fim = dt_fim.replace(hour=23, minute=59, second=59)
+
+            query = query.filter(
+                EntregaEpi.data_entrega >= dt_inicio,
+                EntregaEpi.data_entrega <= dt_fim
+            )
+        except Exception as e:
+            print("Erro no filtro:", e)
+
+    entregas = query.order_by(EntregaEpi.data_entrega.asc()).all()
+
+    if data_inicio and data_fim:
+        periodo = f"Movimentações entre: {dt_inicio.strftime('%d/%m/%Y')} até {dt_fim.strftime('%d/%m/%Y')}"
+    else:
+        periodo = "Movimentações de todo o período"
+
+    # -----------------------------
+    # LINHAS DA TABELA
+    # -----------------------------
+    linhas = []
+
+    for e in entregas:
+        data_entrega = e.data_entrega.strftime('%d/%m/%Y')
+
+        if e.data_devolucao:
+            data_dev = e.data_devolucao.strftime('%d/%m/%Y')
+        elif e.data_descarte:
+            data_dev = e.data_descarte.strftime('%d/%m/%Y')
+        else:
+            data_dev = "-"
+
+        linhas.append([
+            e.epi.nome,
+            e.epi.numero_ca or "-",
+            str(e.quantidade),
+            data_entrega,
+            data_dev,
+            e.status.capitalize()
+        ])
+
+    # -----------------------------
+    # PDF (fora da thread da requisição)
+    # -----------------------------
+    dados_func = {"nome": func.nome, "matricula": func.matricula, "setor": func.setor}
+    caminho = _rodar_pdf(_gerar_ficha_pdf, dados_func, periodo, linhas)
+
+    response = send_file(caminho, mimetype='application/pdf', etag=False,
+                         download_name=f'ficha_{func.nome.replace(" ", "_")}.pdf')
+    os.unlink(caminho)   # o send_file já abriu o arquivo; ele vale até ser fechado
     return response
 
 
@@ -991,9 +1662,12 @@ def entregas():
     # --------------------------------------------
     # 🔵 TABELA PRINCIPAL: SOMENTE ENTREGAS ATIVAS
     # --------------------------------------------
+    # contains_eager: funcionario/epi vêm do próprio JOIN, sem SELECT por linha
     query = (EntregaEpi.query
              .join(Funcionario)
              .join(Epi)
+             .options(contains_eager(EntregaEpi.funcionario),
+                      contains_eager(EntregaEpi.epi))
              .filter(EntregaEpi.status == 'entregue'))
 
     if colaborador:
@@ -1020,9 +1694,7 @@ def entregas():
     # --------------------------------------------
     # 📘 HISTÓRICO COMPLETO (entregue/devolvido/descartado)
     # --------------------------------------------
-    historico = (EntregaEpi.query
-                 .order_by(EntregaEpi.data_entrega.desc())
-                 .all())
+    historico = _paginar_historico(request.args.get('page', 1, type=int))
 
     return render_template(
         'entregas.html',
@@ -1032,34 +1704,102 @@ def entregas():
     )
 
 
+HISTORICO_POR_PAGINA = 50
+
+
+def _paginar_historico(page):
+    """Uma página do histórico de movimentações, mais recentes primeiro."""
+    return (EntregaEpi.query
+            .options(selectinload(EntregaEpi.funcionario),
+                     selectinload(EntregaEpi.epi))
+            .order_by(EntregaEpi.data_entrega.desc())
+            .paginate(page=page, per_page=HISTORICO_POR_PAGINA, error_out=False))
+
+
+# ============================
+# HISTÓRICO PAGINADO (JSON)
+# ============================
+@app.route('/historico_entregas')
+@login_required
+def historico_entregas():
+    """Próximas páginas do modal de relatórios, carregadas sob demanda."""
+    historico = _paginar_historico(request.args.get('page', 1, type=int))
+
+    itens = [{
+        "id": h.id,
+        "data_entrega": h.data_entrega.strftime('%d/%m/%Y %H:%M'),
+        "funcionario": h.funcionario.nome,
+        "epi": h.epi.nome,
+        "quantidade": h.quantidade,
+        "status": h.status,
+        "entregue_por": h.entregue_por or "-",
+        "pdf_url": url_for('pdf_movimentacao', entrega_id=h.id),
+    } for h in historico.items]
+
+    return jsonify({
+        "itens": itens,
+        "proxima_pagina": historico.next_num if historico.has_next else None
+    })
+
+
 # =====================================================
 # 🔵 DEVOLUÇÃO PARCIAL / TOTAL (CORRIGIDO)
 # =====================================================
+def _baixar_entrega(entrega_id, qtd, status_final, campo_data):
+    """
+    Devolução/descarte num único UPDATE, sem carregar a entrega.
+    A condição do WHERE (não finalizada e quantidade suficiente) protege
+    contra duas baixas simultâneas; se nada for alterado, devolve a
+    resposta de erro adequada, senão None.
+    """
+    total = EntregaEpi.quantidade == qtd
+    alteradas = (EntregaEpi.query
+                 .filter(EntregaEpi.id == entrega_id,
+                         EntregaEpi.status.notin_(("devolvido", "descartado")),
+                         EntregaEpi.quantidade >= qtd)
+                 .update({
+                     # baixa total finaliza a entrega; a parcial mantém o status
+                     EntregaEpi.status: case((total, status_final), else_=EntregaEpi.status),
+                     campo_data: case((total, agora_utc()), else_=campo_data),
+                     EntregaEpi.quantidade: qtd,
+                 }, synchronize_session=False))
+
+    if alteradas:
+        return None
+
+    # nada mudou: descobre o motivo (só no caminho de erro)
+    status, _ = (db.session.query(EntregaEpi.status, EntregaEpi.quantidade)
+                 .filter_by(id=entrega_id)
+                 .first_or_404())
+    if status in ("devolvido", "descartado"):
+        return jsonify({"status": "erro", "mensagem": "Esta entrega já foi finalizada."}), 400
+    return jsonify({"status": "erro", "mensagem": "Quantidade inválida."}), 400
+
+
 @app.route("/devolver_epi/<int:entrega_id>", methods=["POST"])
 @login_required
 def devolver_epi(entrega_id):
     data = request.get_json()
     qtd = int(data.get("quantidade", 0))
 
-    entrega = EntregaEpi.query.get_or_404(entrega_id)
-    epi = entrega.epi
-
-    if entrega.status in ("devolvido", "descartado"):
-        return jsonify({"status": "erro", "mensagem": "Esta entrega já foi finalizada."}), 400
-
-    if qtd <= 0 or qtd > entrega.quantidade:
+    if qtd <= 0:
         return jsonify({"status": "erro", "mensagem": "Quantidade inválida."}), 400
 
-    # 🔵 DEVOLUÇÃO TOTAL
-    if qtd == entrega.quantidade:
-        entrega.status = "devolvido"
-        entrega.data_devolucao = datetime.utcnow()
+    # 🔵 DEVOLUÇÃO TOTAL → status "devolvido"; PARCIAL → mantém quantidade REAL devolvida
+    erro = _baixar_entrega(entrega_id, qtd, "devolvido", EntregaEpi.data_devolucao)
+    if erro:
+        return erro
 
-    # 🔵 DEVOLUÇÃO PARCIAL → mantém quantidade REAL devolvida
-    entrega.quantidade = qtd   # ← AGORA NÃO ZERA MAIS
-    epi.quantidade += qtd      # ← Volta para o estoque
+    # 🔵 Volta para o estoque (incremento no próprio banco)
+    epi_da_entrega = (db.session.query(EntregaEpi.epi_id)
+                      .filter(EntregaEpi.id == entrega_id)
+                      .scalar_subquery())
+    (Epi.query
+     .filter(Epi.id == epi_da_entrega)
+     .update({Epi.quantidade: Epi.quantidade + qtd}, synchronize_session=False))
 
     db.session.commit()
+    _invalidar_dashboard()
 
     return jsonify({"status": "ok"}), 200
 
@@ -1074,26 +1814,19 @@ def descartar_epi(entrega_id):
     data = request.get_json()
     qtd = int(data.get("quantidade", 0))
 
-    entrega = EntregaEpi.query.get_or_404(entrega_id)
-    epi = entrega.epi
-
-    if entrega.status in ("devolvido", "descartado"):
-        return jsonify({"status": "erro", "mensagem": "Esta entrega já foi finalizada."}), 400
-
-    if qtd <= 0 or qtd > entrega.quantidade:
+    if qtd <= 0:
         return jsonify({"status": "erro", "mensagem": "Quantidade inválida."}), 400
 
-    # 🔴 DESCARTE TOTAL
-    if qtd == entrega.quantidade:
-        entrega.status = "descartado"
-        entrega.data_descarte = datetime.utcnow()
+    # 🔴 DESCARTE TOTAL → status "descartado"; PARCIAL → mantém quantidade REAL descartada
+    erro = _baixar_entrega(entrega_id, qtd, "descartado", EntregaEpi.data_descarte)
+    if erro:
+        return erro
 
-    # 🔴 DESCARTE PARCIAL → mantém quantidade REAL descartada
-    entrega.quantidade = qtd   # ← NÃO ZERA MAIS
     # ❗ Não volta para o estoque
     # epi.quantidade NÃO É ALTERADO
 
     db.session.commit()
+    _invalidar_dashboard()
 
     return jsonify({"status": "ok"}), 200
 
@@ -1101,21 +1834,30 @@ def descartar_epi(entrega_id):
 # =========================================
 # GERAR PDF DE MOVIMENTAÇÃO — ESTILO FICHA + TERMO (FINAL)
 # =========================================
-@app.route('/pdf_movimentacao/<int:entrega_id>')
-@login_required
-def pdf_movimentacao(entrega_id):
+def _gerar_movimentacao_pdf(pasta, funcionario, emissao, tabela_dados):
+    """
+    Desenha o PDF de movimentação num arquivo temporário próprio dentro de
+    `pasta` e devolve o caminho; quem chamou abre e renomeia para o nome final.
+    Roda num processo do _pdf_pool(), como a ficha: recebe só dados simples.
+    """
+    fd, temporario = mkstemp(dir=pasta, suffix='.tmp')
+    os.close(fd)
+
+    try:
+        _desenhar_movimentacao(temporario, funcionario, emissao, tabela_dados)
+    except Exception:
+        os.unlink(temporario)
+        raise
+
+    return temporario
+
+
+def _desenhar_movimentacao(destino, funcionario, emissao, tabela_dados):
     from reportlab.lib.pagesizes import A4
     from reportlab.pdfgen import canvas
-    from reportlab.platypus import Table, TableStyle
-    from reportlab.lib import colors
-    import os
-
-    entrega = EntregaEpi.query.get_or_404(entrega_id)
-    func = entrega.funcionario
-    epi = entrega.epi
+    from reportlab.platypus import Table
 
-    buffer = BytesIO()
-    pdf = canvas.Canvas(buffer, pagesize=A4)
+    pdf = canvas.Canvas(destino, pagesize=A4)
     width, height = A4
 
     # ======================= MOLDURA =======================
@@ -1124,9 +1866,9 @@ def pdf_movimentacao(entrega_id):
     pdf.rect(20, 20, width - 40, height - 40)
 
     # ======================= LOGO (AJUSTADA PARA O TOPO) =======================
-    logo_path = os.path.join("static", "adaptlink.png")
-    if os.path.exists(logo_path):
-        pdf.drawImage(logo_path, 30, height - 65, width=60, height=40, mask='auto')
+    logo = _logo_pdf()
+    if logo:
+        pdf.drawImage(logo, 30, height - 65, width=60, height=40, mask='auto')
 
     # ======================= CABEÇALHO (ABAIXADO) =======================
     pdf.setFont("Helvetica-Bold", 12)
@@ -1153,10 +1895,10 @@ def pdf_movimentacao(entrega_id):
     pdf.line(40, y - 2, width - 40, y - 2)
 
     pdf.setFont("Helvetica", 9)
-    pdf.drawString(40, y - 15, f"Nome: {func.nome}")
-    pdf.drawRightString(width - 40, y - 15, f"Data de emissão: {datetime.now().strftime('%d/%m/%Y')}")
-    pdf.drawString(40, y - 27, f"Matrícula: {func.matricula}")
-    pdf.drawString(40, y - 39, f"Setor: {func.setor or '-'}")
+    pdf.drawString(40, y - 15, f"Nome: {funcionario['nome']}")
+    pdf.drawRightString(width - 40, y - 15, f"Data de emissão: {emissao}")
+    pdf.drawString(40, y - 27, f"Matrícula: {funcionario['matricula']}")
+    pdf.drawString(40, y - 39, f"Setor: {funcionario['setor'] or '-'}")
 
     # ======================= TERMO DE RESPONSABILIDADE =======================
     y_termo = y - 70
@@ -1165,23 +1907,12 @@ def pdf_movimentacao(entrega_id):
     pdf.drawString(40, y_termo, "TERMO DE RESPONSABILIDADE")
     pdf.line(40, y_termo - 2, width - 40, y_termo - 2)
 
-    termo = (
-        "Declaro para os devidos fins que recebi o(s) EPI(s) relacionado(s) neste documento e me comprometo a:\n"
-        "• Usá-los apenas para as finalidades a que se destinam;\n"
-        "• Responsabilizar-me por sua guarda e conservação;\n"
-        "• Comunicar ao empregador qualquer modificação que os torne impróprios para o uso;\n"
-        "• Responsabilizar-me pela danificação do E.P.I. devido ao uso inadequado ou fora das atividades a que se destinam, bem como pelo seu extravio.\n\n"
-        "Declaro ainda estar ciente de que o uso é obrigatório, sob pena de ser punido conforme LEI nº 6.514/1977, artigo 158:\n"
-        "“Recusa injustificada ao uso do EPI constitui ato faltoso, autorizando a dispensa por justa causa.”\n\n"
-        "Declaro também que recebi treinamento referente ao uso e conservação do E.P.I. segundo as Normas de Segurança do Trabalho."
-    )
-
     txt = pdf.beginText(40, y_termo - 20)
     txt.setFont("Helvetica", 8.5)
     txt.setLeading(12)
 
-    for linha in termo.split("\n"):
-        txt.textLine(linha.strip())
+    for linha in TERMO_MOVIMENTACAO_LINHAS:
+        txt.textLine(linha)
 
     pdf.drawText(txt)
 
@@ -1193,36 +1924,12 @@ def pdf_movimentacao(entrega_id):
     pdf.drawString(40, y_after_termo, "DETALHES DA MOVIMENTAÇÃO")
     pdf.line(40, y_after_termo - 2, width - 40, y_after_termo - 2)
 
-    tabela_dados = [
-        ["Campo", "Informação"],
-        ["EPI", epi.nome],
-        ["CA", epi.numero_ca or "-"],
-        ["Quantidade", str(entrega.quantidade)],
-        ["Status", entrega.status.capitalize()],
-        ["Entregue por", entrega.entregue_por or "-"],
-        ["Data da operação", entrega.data_entrega.strftime("%d/%m/%Y %H:%M")]
-    ]
-
-    if entrega.status == "devolvido" and entrega.data_devolucao:
-        tabela_dados.append(["Data da devolução", entrega.data_devolucao.strftime("%d/%m/%Y %H:%M")])
-
-    if entrega.status == "descartado" and entrega.data_descarte:
-        tabela_dados.append(["Data do descarte", entrega.data_descarte.strftime("%d/%m/%Y %H:%M")])
-
     table = Table(tabela_dados, colWidths=[160, 320])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-        ('GRID', (0, 0), (-1, -1), 0.3, colors.grey),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-    ]))
+    table.setStyle(_estilo_tabela_movimentacao())
 
-    table_y = y_after_termo - 40 - (len(tabela_dados) * 18)
-    table.wrapOn(pdf, width, height)
+    # altura real medida pelo ReportLab, sem estimar 18 pt por linha
+    table_width, table_height = table.wrapOn(pdf, width - 80, height)
+    table_y = y_after_termo - 40 - table_height
     table.drawOn(pdf, 40, table_y)
 
     # ======================= ASSINATURAS =======================
@@ -1245,15 +1952,101 @@ def pdf_movimentacao(entrega_id):
     pdf.showPage()
     pdf.save()
 
-    pdf_data = buffer.getvalue()
-    buffer.close()
 
-    response = make_response(pdf_data)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'inline; filename=movimentacao_{entrega_id}.pdf'
+def _pasta_pdfs():
+    """Pasta do cache em disco dos PDFs de movimentação."""
+    return app.config.get('PDF_CACHE_DIR') or os.path.join(app.instance_path, 'pdfs')
+
+
+def _remover_pdfs_movimentacao(entrega_ids, manter=None):
+    """Apaga do cache em disco os PDFs dessas entregas (exceto `manter`)."""
+    pasta = _pasta_pdfs()
+    for entrega_id in entrega_ids:
+        for antigo in glob.glob(os.path.join(pasta, f'movimentacao_{entrega_id}_*.pdf')):
+            if antigo != manter:
+                try:
+                    os.unlink(antigo)
+                except OSError:
+                    pass   # outra requisição já apagou
+
+
+def _cache_privado(response):
+    """Documento do usuário logado: só o navegador guarda, e sempre revalida."""
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
     return response
 
 
+@app.route('/pdf_movimentacao/<int:entrega_id>')
+@login_required
+def pdf_movimentacao(entrega_id):
+    # funcionário e EPI no mesmo SELECT da entrega
+    entrega = (EntregaEpi.query
+               .options(joinedload(EntregaEpi.funcionario),
+                        joinedload(EntregaEpi.epi))
+               .filter_by(id=entrega_id)
+               .first_or_404())
+    func = entrega.funcionario
+    epi = entrega.epi
+
+    tabela_dados = [
+        ["Campo", "Informação"],
+        ["EPI", epi.nome],
+        ["CA", epi.numero_ca or "-"],
+        ["Quantidade", str(entrega.quantidade)],
+        ["Status", entrega.status.capitalize()],
+        ["Entregue por", entrega.entregue_por or "-"],
+        ["Data da operação", entrega.data_entrega.strftime("%d/%m/%Y %H:%M")]
+    ]
+
+    if entrega.status == "devolvido" and entrega.data_devolucao:
+        tabela_dados.append(["Data da devolução", entrega.data_devolucao.strftime("%d/%m/%Y %H:%M")])
+
+    if entrega.status == "descartado" and entrega.data_descarte:
+        tabela_dados.append(["Data do descarte", entrega.data_descarte.strftime("%d/%m/%Y %H:%M")])
+
+    dados_func = {"nome": func.nome, "matricula": func.matricula, "setor": func.setor}
+    emissao = datetime.now().strftime('%d/%m/%Y')
+
+    # -----------------------------
+    # CACHE EM DISCO
+    # -----------------------------
+    # O nome do arquivo leva um hash de tudo o que é desenhado: enquanto a
+    # entrega não muda (e no mesmo dia de emissão) o PDF pronto é reaproveitado.
+    assinatura = hashlib.sha1(orjson.dumps([dados_func, emissao, tabela_dados])).hexdigest()[:16]
+
+    # o mesmo hash serve de ETag: se o navegador já tem esta versão, 304
+    # sem abrir (nem gerar) o PDF
+    if request.if_none_match.contains(assinatura):
+        response = app.response_class(status=304)
+        response.set_etag(assinatura)
+        return _cache_privado(response)
+
+    pasta = _pasta_pdfs()
+    os.makedirs(pasta, exist_ok=True)
+    caminho = os.path.join(pasta, f'movimentacao_{entrega_id}_{assinatura}.pdf')
+
+    opcoes = dict(mimetype='application/pdf', etag=assinatura, conditional=True,
+                  download_name=f'movimentacao_{entrega_id}.pdf')
+    try:
+        response = send_file(caminho, **opcoes)
+    except FileNotFoundError:
+        temporario = _rodar_pdf(
+            _gerar_movimentacao_pdf, pasta, dados_func, emissao, tabela_dados
+        )
+
+        # o send_file abre o arquivo gerado por ESTA requisição antes de ele
+        # ser publicado: o handle continua válido mesmo que outra requisição
+        # troque ou apague o nome final logo depois
+        response = send_file(temporario, **opcoes)
+        os.replace(temporario, caminho)
+
+        # versões antigas desta entrega não servem mais
+        _remover_pdfs_movimentacao([entrega_id], manter=caminho)
+
+    return _cache_privado(response)
+
+
 # ============================
 # FUNCIONÁRIOS / LOGS / USUÁRIOS
 # ============================
@@ -1281,12 +2074,19 @@ def cadastro_funcionarios():
             data_admissao=datetime.strptime(data_admissao, "%Y-%m-%d").date()
         )
         db.session.add(novo_func)
-        db.session.commit()
         registrar_log(current_user.nome, f"Cadastrou funcionário: {nome}")
+        db.session.commit()
+        _invalidar_dashboard()
         flash('✅ Funcionário cadastrado com sucesso!')
         return redirect(url_for('cadastro_funcionarios'))
 
-    funcionarios = Funcionario.query.order_by(Funcionario.nome).all()
+    # só as colunas que a tela mostra; da senha basta saber se existe
+    funcionarios = (db.session.query(
+                        Funcionario.id, Funcionario.nome, Funcionario.matricula,
+                        Funcionario.setor, Funcionario.data_admissao,
+                        (func.coalesce(Funcionario.senha_validacao, '') != '').label('tem_senha'))
+                    .order_by(Funcionario.nome)
+                    .all())
     return render_template('cadastro_colaboradores.html', user=current_user, funcionarios=funcionarios)
 
 # ============================
@@ -1303,6 +2103,7 @@ def editar_funcionario(id):
     funcionario.data_admissao = request.form.get('data_admissao') or funcionario.data_admissao
 
     db.session.commit()
+    _invalidar_dashboard()
 
     flash("✅ Funcionário atualizado com sucesso!", "success")
     return redirect(url_for('cadastro_funcionarios'))
@@ -1313,21 +2114,33 @@ def editar_funcionario(id):
 @login_required
 def definir_senha_funcionario(id):
     func = Funcionario.query.get_or_404(id)
-    func.senha_validacao = request.form.get('senha_validacao') or ''
-    db.session.commit()
+    func.definir_senha_validacao(request.form.get('senha_validacao') or '')
     registrar_log(current_user.nome, f"Definiu senha de validação para {func.nome}")
+    db.session.commit()
     flash('🔒 Senha de validação cadastrada com sucesso!')
     return redirect(url_for('cadastro_funcionarios'))
 
 
-@app.route('/deletar_funcionario/<int:id>')
+@app.route('/deletar_funcionario/<int:id>', methods=['POST'])
 @login_required
 def deletar_funcionario(id):
-    func = Funcionario.query.get_or_404(id)
-    EntregaEpi.query.filter_by(funcionario_id=id).delete()
-    db.session.delete(func)
+    _exigir_csrf()
+
+    # um único DELETE para todas as entregas, sem sincronizar a sessão;
+    # os ids voltam para apagar os PDFs em cache (têm nome e matrícula)
+    entregas_ids = db.session.execute(
+        delete(EntregaEpi).where(EntregaEpi.funcionario_id == id).returning(EntregaEpi.id)
+    ).scalars().all()
+    nome = db.session.execute(
+        delete(Funcionario).where(Funcionario.id == id).returning(Funcionario.nome)
+    ).scalar()
+    if nome is None:
+        abort(404)
+
+    registrar_log(current_user.nome, f"Excluiu funcionário: {nome}")
     db.session.commit()
-    registrar_log(current_user.nome, f"Excluiu funcionário: {func.nome}")
+    _remover_pdfs_movimentacao(entregas_ids)
+    _invalidar_dashboard()
     flash('🗑️ Funcionário e entregas associadas removidos com sucesso!')
     return redirect(url_for('cadastro_funcionarios'))
 
@@ -1335,6 +2148,9 @@ def deletar_funcionario(id):
 # ============================
 # LOGS
 # ============================
+LOGS_POR_PAGINA = 50
+
+
 @app.route('/logs')
 @login_required
 def logs():
@@ -1347,18 +2163,12 @@ def logs():
     data_inicio = request.args.get('data_inicio', '').strip()
     data_fim = request.args.get('data_fim', '').strip()
 
-    # Query base
-    query = Log.query
+    # Query base (só as colunas exibidas)
+    query = db.session.query(Log.data_hora, Log.usuario, Log.acao)
 
     # --------- Filtro por texto ---------
     if busca:
-        termo = f"%{busca}%"
-        query = query.filter(
-            db.or_(
-                Log.usuario.ilike(termo),
-                Log.acao.ilike(termo)
-            )
-        )
+        query = query.filter(literal_column(LOG_BUSCA_SQL).ilike(f"%{busca}%"))
 
     # --------- Filtro por período ---------
     if data_inicio and data_fim:
@@ -1375,8 +2185,10 @@ def logs():
         except Exception as e:
             print("Erro no filtro de data:", e)
 
-    # Ordenação
-    logs_filtrados = query.order_by(Log.data_hora.desc()).all()
+    # Ordenação + paginação no banco
+    page = request.args.get('page', 1, type=int)
+    logs_filtrados = (query.order_by(Log.data_hora.desc())
+                      .paginate(page=page, per_page=LOGS_POR_PAGINA, error_out=False))
 
     return render_template('logs.html',
                            user=current_user,
@@ -1403,18 +2215,29 @@ def usuarios():
             flash('⚠️ Preencha todos os campos!')
             return redirect(url_for('usuarios'))
 
-        if User.query.filter_by(login=login_usuario).first():
+        # um único INSERT ... ON CONFLICT (login) DO NOTHING: sem o SELECT
+        # prévio e sem corrida entre dois cadastros do mesmo login
+        insert_dialeto = pg_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+        novo_id = db.session.execute(
+            insert_dialeto(User)
+            .values(nome=nome, login=login_usuario, role=role,
+                    senha_hash=generate_password_hash(senha))
+            .on_conflict_do_nothing(index_elements=['login'])
+            .returning(User.id)
+        ).scalar()
+
+        if novo_id is None:
             flash('⚠️ Já existe um usuário com este login.')
             return redirect(url_for('usuarios'))
 
-        novo_usuario = User(nome=nome, login=login_usuario, senha=senha, role=role)
-        db.session.add(novo_usuario)
-        db.session.commit()
         registrar_log(current_user.nome, f"Cadastrou usuário: {nome}")
+        db.session.commit()
+        _invalidar_dashboard()
         flash('✅ Usuário cadastrado com sucesso!')
         return redirect(url_for('usuarios'))
 
-    usuarios_list = User.query.all()
+    # só as colunas exibidas (nada de hash de senha)
+    usuarios_list = db.session.query(User.id, User.nome, User.login, User.role).all()
     return render_template('usuarios.html', user=current_user, usuarios=usuarios_list)
 
 
@@ -1428,27 +2251,33 @@ def editar_usuario(id):
     usuario = User.query.get_or_404(id)
     usuario.login = (request.form.get('login') or usuario.login).strip()
     usuario.role = request.form.get('role') or usuario.role
-    db.session.commit()
     registrar_log(current_user.nome, f"Editou usuário: {usuario.nome}")
+    db.session.commit()
     flash('✅ Usuário atualizado com sucesso!')
     return redirect(url_for('usuarios'))
 
 
-@app.route('/deletar_usuario/<int:id>')
+@app.route('/deletar_usuario/<int:id>', methods=['POST'])
 @login_required
 def deletar_usuario(id):
     if current_user.role != 'admin':
         flash('🚫 Acesso restrito.')
         return redirect(url_for('dashboard'))
 
-    usuario = User.query.get_or_404(id)
-    if usuario.login == 'admin':
+    _exigir_csrf()
+
+    # o admin padrão fica fora do WHERE; sem linha apagada, vê o motivo
+    nome = db.session.execute(
+        delete(User).where(User.id == id, User.login != 'admin').returning(User.nome)
+    ).scalar()
+    if nome is None:
+        db.session.query(User.id).filter_by(id=id).first_or_404()
         flash('🚫 Não é possível excluir o usuário administrador padrão.')
         return redirect(url_for('usuarios'))
 
-    db.session.delete(usuario)
+    registrar_log(current_user.nome, f"Excluiu usuário: {nome}")
     db.session.commit()
-    registrar_log(current_user.nome, f"Excluiu usuário: {usuario.nome}")
+    _invalidar_dashboard()
     flash('🗑️ Usuário excluído com sucesso!')
     return redirect(url_for('usuarios'))
 
@@ -1458,18 +2287,32 @@ def deletar_usuario(id):
 # ============================
 def criar_admin_padrao():
     if User.query.count() == 0:
-        admin = User(nome="Administrador", login="admin", senha="1234", role="admin")
+        admin = User(nome="Administrador", login="admin", role="admin")
+        admin.definir_senha("1234")
         db.session.add(admin)
         db.session.commit()
         print("✅ Usuário admin criado (login: admin / senha: 1234)")
 
 
+def _preparar_banco():
+    with app.app_context():
+        _migrar_banco()   # tabelas, colunas e índices novos (uma vez por versão)
+        criar_admin_padrao()
+
+
+# Em produção a migração roda uma vez só, ao importar o app com
+# RUN_MIGRATIONS=1 (ex.: no master do gunicorn com preload_app); os
+# workers criados depois por fork não repetem o processo.
+if os.environ.get('RUN_MIGRATIONS'):
+    _preparar_banco()
+
+
 # ============================
 # EXECUÇÃO
 # ============================
+# Servidor de desenvolvimento; em produção use o gunicorn:
+#   gunicorn -c gunicorn_conf.py app:app
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-        _ensure_table_columns()   # migração automática das novas colunas
-        criar_admin_padrao()
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    _preparar_banco()
+    app.run(host="0.0.0.0", port=5000,
+            debug=os.environ.get('FLASK_DEBUG') == '1')
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Configuração do gunicorn para produção:
+#   gunicorn -c gunicorn_conf.py app:app
+import os
+from multiprocessing import cpu_count
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# Cada worker tem também seu pool de PDFs (PDF_WORKERS processos);
+# WEB_CONCURRENCY permite reduzir em máquinas com pouca memória
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 * cpu_count() + 1))
+worker_class = 'gthread'
+threads = 4
+timeout = 60
+
+# O app é importado uma vez no master e os workers herdam a memória por fork
+preload_app = True
+
+# Com o preload, a migração do banco roda uma vez só, no master
+os.environ.setdefault('RUN_MIGRATIONS', '1')
+
+# Cache do dashboard visível a todos os workers (a invalidação feita por um
+# worker vale para os outros); CACHE_TYPE=RedisCache também serve
+os.environ.setdefault('CACHE_TYPE', 'FileSystemCache')
+
+
+def post_fork(server, worker):
+    # conexões abertas pelo master (migração) não podem ser compartilhadas
+    from app import app, db
+
+    with app.app_context():
+        db.engine.dispose(close=False)